@@ -1,13 +1,118 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response
 import re
 import logging
 import uuid
+import struct
+import sys
+import os
+import hashlib
+import gzip
+import signal
+import time
+import multiprocessing
+from array import array
+from collections import OrderedDict
+from itertools import accumulate, islice, repeat
+from operator import add, floordiv, itemgetter, mul, sub
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from werkzeug.serving import make_server
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+KEYWORDS = ("int", "for", "if", "else", "while", "return")
+OPERATORS = ("+", "-", "*", "/", "=", "<", ">", ";", "{", "}", "(", ")")
+TOKEN_PATTERN = re.compile(r'//.*$|/\*.*?\*/|\s+|\w+|[{}();+\-*/=<>]', re.MULTILINE | re.DOTALL)
+LITERAL_PATTERN = re.compile(r'^\d+$')
+IDENTIFIER_PATTERN = re.compile(r'^[a-zA-Z_]\w*$')
+TOKEN_TYPES = ("KEYWORD", "OPERATOR", "LITERAL", "IDENTIFIER")
+TOKEN_KEYWORD, TOKEN_OPERATOR, TOKEN_LITERAL, TOKEN_IDENTIFIER = range(len(TOKEN_TYPES))
+# String table IDs of the keywords and operators, which every compilation
+# interns first and in this order
+(ID_INT, ID_FOR, ID_IF, ID_ELSE, ID_WHILE, ID_RETURN,
+ ID_PLUS, ID_MINUS, ID_TIMES, ID_DIVIDE, ID_ASSIGN, ID_LESS, ID_GREATER,
+ ID_SEMICOLON, ID_LBRACE, ID_RBRACE, ID_LPAREN, ID_RPAREN) = range(len(KEYWORDS + OPERATORS))
+ARITHMETIC_IDS = (ID_PLUS, ID_MINUS, ID_TIMES, ID_DIVIDE)
+BINOP_FUNCTIONS = {ID_PLUS: add, ID_MINUS: sub, ID_TIMES: mul, ID_DIVIDE: floordiv}
+
+# Binary artifact format (all integers little-endian). After the header every
+# section is made of columns: a u8 item size (1, 2 or 4 bytes, the narrowest
+# that fits the column), a u32 item count, then the items.
+#   header        magic, format version
+#   string table  string list
+#   tokens        token columns: types, string IDs, line numbers
+#   ast           node kinds, node list lengths, the field columns of each
+#                 node kind, the end offsets of every FOR condition and
+#                 increment, then the token columns of those conditions and
+#                 increments
+#   intermediate code, optimized code
+#                 op kinds, then the field columns of each op kind
+#   assembly code, errors
+#                 string list
+# A string list is a column of end offsets followed by the UTF-8 bytes of all
+# strings back to back. Every node and op kind has its own fixed set of field
+# columns (string IDs, then the line number), so a section is decoded by
+# zipping whole columns and interleaving the results in kind order. Node
+# lists (the top level and every FUNCTION, FOR and FOR initializer body) are
+# stored children first, so FUNCTION and FOR fields refer to lists by index.
+ARTIFACT_MAGIC = b"CCVZ"
+ARTIFACT_VERSION = 3
+ARTIFACT_HEADER = struct.Struct("<4sH")
+ARTIFACT_COLUMN = struct.Struct("<BI")
+COLUMN_TYPECODES = {array(code).itemsize: code for code in "BHI"}
+IR_OPS = ("assign", "binop", "return", "loop", "endloop")
+IR_KINDS = {name: kind for kind, name in enumerate(IR_OPS)}
+IR_ARITY = (2, 4, 1, 6, 1)
+(NODE_DECLARATION, NODE_DECLARATION_VALUE, NODE_DECLARATION_EXPR, NODE_ASSIGNMENT,
+ NODE_ASSIGNMENT_EXPR, NODE_RETURN, NODE_FUNCTION, NODE_FOR) = range(8)
+# Field columns per node kind, and how many of the leading ones are string IDs.
+# FUNCTION fields are type, name and body list; FOR fields are initializer
+# list and body list.
+NODE_WIDTHS = (3, 4, 6, 3, 5, 2, 3, 2)
+NODE_ID_FIELDS = (2, 3, 5, 2, 4, 1, 2, 0)
+
+# Bump whenever lowering or optimization changes what the compiler produces,
+# so ETags of cached /compile responses change with it
+COMPILER_VERSION = 3
+
+# Loop bodies without a closed form are evaluated for every iteration at
+# compile time, for loops of up to LOOP_BATCH_LIMIT iterations and within
+# LOOP_BATCH_BUDGET element operations per compile. The limits are the same
+# with or without NumPy, so the compiled code is too: NumPy int64 arrays only
+# speed up the evaluation, and Python ints take over wherever int64 could
+# overflow.
+LOOP_BATCH_LIMIT = 100_000
+LOOP_BATCH_BUDGET = 2_000_000
+INT64_SAFE_BOUND = 2 ** 62
+
+# Sources split into at least this many top-level chunks (functions and the
+# declarations before them) may be lexed in a process pool
+PARALLEL_MIN_FUNCTIONS = 256
+# The serial and pooled lexers are timed alternately on large sources until
+# each has LEXER_CALIBRATION_SAMPLES samples. After that the faster one on
+# average is used, and the slower one is timed again every
+# LEXER_RESAMPLE_INTERVAL large sources. LEXER_RATE_WEIGHT is the weight of a
+# new sample in each moving average.
+LEXER_CALIBRATION_SAMPLES = 3
+LEXER_RESAMPLE_INTERVAL = 32
+LEXER_RATE_WEIGHT = 0.25
+# Braces and the comments that may hide them, matched the way the lexer
+# splits each line
+BRACE_SCAN_PATTERN = re.compile(r'//[^\n]*|/\*[^\n]*?\*/|[{}\n]')
+
 class CCompiler:
     def __init__(self):
         self.reset_state()
@@ -15,36 +120,58 @@ class CCompiler:
     def reset_state(self):
         self.tokens = []
         self.ast = []
-        self.symbol_table = {}
+        self.symbol_table = []
         self.errors = []
         self.intermediate_code = []
         self.optimized_code = []
         self.assembly_code = []
         self.code = ""
+        self.loop_batch_budget = LOOP_BATCH_BUDGET
+        # Per-compilation string table. Tokens, AST and IR refer to every
+        # keyword, operator, identifier and literal by its index here, and the
+        # text is only looked up again for errors and display. literal_values
+        # holds the integer value of each decimal literal and None for every
+        # other string. Keywords and operators are seeded first so their
+        # indexes match the ID_* constants.
+        self.string_table = []
+        self.string_ids = {}
+        self.literal_values = []
+        for text in KEYWORDS + OPERATORS:
+            self.intern(text)
+
+    def intern(self, text):
+        sid = self.string_ids.get(text)
+        if sid is None:
+            sid = len(self.string_table)
+            self.string_table.append(text)
+            self.string_ids[text] = sid
+            self.literal_values.append(int(text) if text.isdecimal() else None)
+        return sid
 
-    def lexer(self, code):
+    def lexer(self, code, first_line=1):
         self.code = code
         self.tokens = []
         self.errors = []
-        keywords = {"int", "for", "if", "else", "while", "return"}
-        operators = {"+", "-", "*", "/", "=", "<", ">", ";", "{", "}", "(", ")"}
-        token_pattern = r'//.*$|/\*.*?\*/|\s+|\w+|[{}();+\-*/=<>]'
+        keywords = set(KEYWORDS)
+        operators = set(OPERATORS)
         lines = code.split('\n')
-        for line_num, line in enumerate(lines, 1):
-            tokens = re.findall(token_pattern, line, re.MULTILINE | re.DOTALL)
+        for line_num, line in enumerate(lines, first_line):
+            tokens = TOKEN_PATTERN.findall(line)
             for token in tokens:
                 if token.startswith('//') or token.startswith('/*') or token.isspace():
                     continue
                 elif token in keywords:
-                    self.tokens.append(("KEYWORD", token, line_num))
+                    token_type = TOKEN_KEYWORD
                 elif token in operators:
-                    self.tokens.append(("OPERATOR", token, line_num))
-                elif re.match(r'^\d+$', token):
-                    self.tokens.append(("LITERAL", token, line_num))
-                elif re.match(r'^[a-zA-Z_]\w*$', token):
-                    self.tokens.append(("IDENTIFIER", token, line_num))
+                    token_type = TOKEN_OPERATOR
+                elif LITERAL_PATTERN.match(token):
+                    token_type = TOKEN_LITERAL
+                elif IDENTIFIER_PATTERN.match(token):
+                    token_type = TOKEN_IDENTIFIER
                 else:
                     self.errors.append(f"Line {line_num}: Invalid token '{token}'")
+                    continue
+                self.tokens.append((token_type, self.intern(token), line_num))
         return self.tokens
 
     def parser(self):
@@ -52,19 +179,19 @@ class CCompiler:
         i = 0
         while i < len(self.tokens):
             token_type, token_value, line_num = self.tokens[i]
-            if token_type == "KEYWORD" and token_value == "int":
+            if token_value == ID_INT:
                 i, decl = self.parse_declaration(i)
                 if decl:
                     self.ast.append(decl)
-            elif token_type == "KEYWORD" and token_value == "for":
+            elif token_value == ID_FOR:
                 i, stmt = self.parse_for(i)
                 if stmt:
                     self.ast.append(stmt)
-            elif token_type == "IDENTIFIER":
+            elif token_type == TOKEN_IDENTIFIER:
                 i, assign = self.parse_assignment(i)
                 if assign:
                     self.ast.append(assign)
-            elif token_type == "KEYWORD" and token_value == "return":
+            elif token_value == ID_RETURN:
                 i, ret = self.parse_return(i)
                 if ret:
                     self.ast.append(ret)
@@ -75,37 +202,37 @@ class CCompiler:
     def parse_declaration(self, i):
         type_token = self.tokens[i]
         i += 1
-        if i >= len(self.tokens) or self.tokens[i][0] != "IDENTIFIER":
+        if i >= len(self.tokens) or self.tokens[i][0] != TOKEN_IDENTIFIER:
             self.errors.append(f"Line {type_token[2]}: Expected identifier after 'int'")
             return i, None
         var_name = self.tokens[i][1]
         line_num = self.tokens[i][2]
         i += 1
-        if i < len(self.tokens) and self.tokens[i][1] == "(":
+        if i < len(self.tokens) and self.tokens[i][1] == ID_LPAREN:
             i += 1
-            if i >= len(self.tokens) or self.tokens[i][1] != ")":
+            if i >= len(self.tokens) or self.tokens[i][1] != ID_RPAREN:
                 self.errors.append(f"Line {type_token[2]}: Expected ')' after '(' in function declaration")
                 return i, None
             i += 1
-            if i >= len(self.tokens) or self.tokens[i][1] != "{":
+            if i >= len(self.tokens) or self.tokens[i][1] != ID_LBRACE:
                 self.errors.append(f"Line {type_token[2]}: Expected '{{' after function declaration")
                 return i, None
             i += 1
             body = []
-            while i < len(self.tokens) and self.tokens[i][1] != "}":
-                if self.tokens[i][0] == "KEYWORD" and self.tokens[i][1] == "int":
+            while i < len(self.tokens) and self.tokens[i][1] != ID_RBRACE:
+                if self.tokens[i][1] == ID_INT:
                     i, decl = self.parse_declaration(i)
                     if decl:
                         body.append(decl)
-                elif self.tokens[i][0] == "IDENTIFIER":
+                elif self.tokens[i][0] == TOKEN_IDENTIFIER:
                     i, assign = self.parse_assignment(i)
                     if assign:
                         body.append(assign)
-                elif self.tokens[i][0] == "KEYWORD" and self.tokens[i][1] == "for":
+                elif self.tokens[i][1] == ID_FOR:
                     i, stmt = self.parse_for(i)
                     if stmt:
                         body.append(stmt)
-                elif self.tokens[i][0] == "KEYWORD" and self.tokens[i][1] == "return":
+                elif self.tokens[i][1] == ID_RETURN:
                     i, ret = self.parse_return(i)
                     if ret:
                         body.append(ret)
@@ -115,51 +242,51 @@ class CCompiler:
                 self.errors.append(f"Line {type_token[2]}: Missing '}}' in function body")
                 return i, None
             i += 1
-            return i, ("FUNCTION", "int", var_name, body)
-        elif i < len(self.tokens) and self.tokens[i][1] == "=":
+            return i, ("FUNCTION", ID_INT, var_name, body)
+        elif i < len(self.tokens) and self.tokens[i][1] == ID_ASSIGN:
             i += 1
             expr = []
-            while i < len(self.tokens) and self.tokens[i][1] != ";":
+            while i < len(self.tokens) and self.tokens[i][1] != ID_SEMICOLON:
                 expr.append(self.tokens[i])
                 i += 1
             if i >= len(self.tokens):
                 self.errors.append(f"Line {type_token[2]}: Missing ';' after declaration")
                 return i, None
             i += 1
-            if len(expr) == 1 and expr[0][0] in ["LITERAL", "IDENTIFIER"]:
+            if len(expr) == 1 and expr[0][0] in (TOKEN_LITERAL, TOKEN_IDENTIFIER):
                 value = expr[0][1]
-                return i, ("DECLARATION", "int", var_name, value, line_num)
-            elif len(expr) == 3 and expr[1][0] == "OPERATOR" and expr[1][1] in ["+", "-", "*", "/"]:
-                return i, ("DECLARATION", "int", var_name, (expr[1][1], expr[0][1], expr[2][1]), line_num)
+                return i, ("DECLARATION", ID_INT, var_name, value, line_num)
+            elif len(expr) == 3 and expr[1][1] in ARITHMETIC_IDS:
+                return i, ("DECLARATION", ID_INT, var_name, (expr[1][1], expr[0][1], expr[2][1]), line_num)
             else:
                 self.errors.append(f"Line {type_token[2]}: Invalid expression in declaration")
                 return i, None
         else:
-            if i >= len(self.tokens) or self.tokens[i][1] != ";":
+            if i >= len(self.tokens) or self.tokens[i][1] != ID_SEMICOLON:
                 self.errors.append(f"Line {type_token[2]}: Missing ';' after declaration")
                 return i, None
             i += 1
-            return i, ("DECLARATION", "int", var_name, None, line_num)
+            return i, ("DECLARATION", ID_INT, var_name, None, line_num)
 
     def parse_assignment(self, i):
         var_name = self.tokens[i][1]
         line_num = self.tokens[i][2]
         i += 1
-        if i >= len(self.tokens) or self.tokens[i][1] != "=":
+        if i >= len(self.tokens) or self.tokens[i][1] != ID_ASSIGN:
             return i, None
         i += 1
         expr = []
-        while i < len(self.tokens) and self.tokens[i][1] != ";":
+        while i < len(self.tokens) and self.tokens[i][1] != ID_SEMICOLON:
             expr.append(self.tokens[i])
             i += 1
         if i >= len(self.tokens):
             self.errors.append(f"Line {line_num}: Missing ';' after assignment")
             return i, None
         i += 1
-        if len(expr) == 1 and expr[0][0] in ["LITERAL", "IDENTIFIER"]:
+        if len(expr) == 1 and expr[0][0] in (TOKEN_LITERAL, TOKEN_IDENTIFIER):
             value = expr[0][1]
             return i, ("ASSIGNMENT", var_name, value, line_num)
-        elif len(expr) == 3 and expr[1][0] == "OPERATOR" and expr[1][1] in ["+", "-", "*", "/"]:
+        elif len(expr) == 3 and expr[1][1] in ARITHMETIC_IDS:
             return i, ("ASSIGNMENT", var_name, (expr[1][1], expr[0][1], expr[2][1]), line_num)
         else:
             self.errors.append(f"Line {line_num}: Invalid expression in assignment")
@@ -168,13 +295,13 @@ class CCompiler:
     def parse_for(self, i):
         line_num = self.tokens[i][2]
         i += 1
-        if i >= len(self.tokens) or self.tokens[i][1] != "(":
+        if i >= len(self.tokens) or self.tokens[i][1] != ID_LPAREN:
             self.errors.append(f"Line {line_num}: Missing '(' after 'for'")
             return i, None
         i += 1
-        if self.tokens[i][0] == "KEYWORD" and self.tokens[i][1] == "int":
+        if self.tokens[i][1] == ID_INT:
             i, init = self.parse_declaration(i)
-        elif self.tokens[i][0] == "IDENTIFIER":
+        elif self.tokens[i][0] == TOKEN_IDENTIFIER:
             i, init = self.parse_assignment(i)
         else:
             self.errors.append(f"Line {line_num}: Invalid for loop initialization")
@@ -182,7 +309,7 @@ class CCompiler:
         if not init:
             return i, None
         cond_start = i
-        while i < len(self.tokens) and self.tokens[i][1] != ";":
+        while i < len(self.tokens) and self.tokens[i][1] != ID_SEMICOLON:
             i += 1
         if i >= len(self.tokens):
             self.errors.append(f"Line {line_num}: Missing first ';' in 'for' loop")
@@ -190,37 +317,37 @@ class CCompiler:
         condition = self.tokens[cond_start:i]
         i += 1
         incr_start = i
-        while i < len(self.tokens) and self.tokens[i][1] != ")":
+        while i < len(self.tokens) and self.tokens[i][1] != ID_RPAREN:
             i += 1
         if i >= len(self.tokens):
             self.errors.append(f"Line {line_num}: Missing ')' in 'for' loop")
             return i, None
         increment = self.tokens[incr_start:i]
         i += 1
-        if i >= len(self.tokens) or self.tokens[i][1] != "{":
+        if i >= len(self.tokens) or self.tokens[i][1] != ID_LBRACE:
             self.errors.append(f"Line {line_num}: Missing '{{' after 'for'")
             return i, None
         i += 1
         body = []
-        while i < len(self.tokens) and self.tokens[i][1] != "}":
-            if self.tokens[i][0] == "KEYWORD" and self.tokens[i][1] == "int":
+        while i < len(self.tokens) and self.tokens[i][1] != ID_RBRACE:
+            if self.tokens[i][1] == ID_INT:
                 i, decl = self.parse_declaration(i)
                 if decl:
                     body.append(decl)
-            elif self.tokens[i][0] == "IDENTIFIER":
+            elif self.tokens[i][0] == TOKEN_IDENTIFIER:
                 i, assign = self.parse_assignment(i)
                 if assign:
                     body.append(assign)
-            elif self.tokens[i][0] == "KEYWORD" and self.tokens[i][1] == "for":
+            elif self.tokens[i][1] == ID_FOR:
                 i, stmt = self.parse_for(i)
                 if stmt:
                     body.append(stmt)
-            elif self.tokens[i][0] == "KEYWORD" and self.tokens[i][1] == "return":
+            elif self.tokens[i][1] == ID_RETURN:
                 i, ret = self.parse_return(i)
                 if ret:
                     body.append(ret)
             else:
-                self.errors.append(f"Line {self.tokens[i][2]}: Unexpected token '{self.tokens[i][1]}' in for loop body")
+                self.errors.append(f"Line {self.tokens[i][2]}: Unexpected token '{self.string_table[self.tokens[i][1]]}' in for loop body")
                 i += 1
         if i >= len(self.tokens):
             self.errors.append(f"Line {line_num}: Missing '}}' in 'for' loop")
@@ -231,12 +358,12 @@ class CCompiler:
     def parse_return(self, i):
         line_num = self.tokens[i][2]
         i += 1
-        if i >= len(self.tokens) or self.tokens[i][0] not in ["LITERAL", "IDENTIFIER"]:
+        if i >= len(self.tokens) or self.tokens[i][0] not in (TOKEN_LITERAL, TOKEN_IDENTIFIER):
             self.errors.append(f"Line {line_num}: Expected value after 'return'")
             return i, None
         value = self.tokens[i][1]
         i += 1
-        if i >= len(self.tokens) or self.tokens[i][1] != ";":
+        if i >= len(self.tokens) or self.tokens[i][1] != ID_SEMICOLON:
             self.errors.append(f"Line {line_num}: Missing ';' after 'return'")
             return i, None
         i += 1
@@ -245,49 +372,56 @@ class CCompiler:
     def semantic_analyzer(self, nodes=None):
         if nodes is None:
             nodes = self.ast
+            # Indexed by string ID: the declared type's ID, or None while the
+            # name is undeclared
+            self.symbol_table = [None] * len(self.string_table)
+        symbol_table = self.symbol_table
+        literal_values = self.literal_values
+        names = self.string_table
         for node in nodes:
             if node[0] == "DECLARATION" or node[0] == "FUNCTION":
                 var_type, var_name = node[1], node[2]
-                value = node[3] if node[0] == "DECLARATION" else None
-                line_num = node[-1]
-                if var_name in self.symbol_table:
-                    self.errors.append(f"Line {line_num}: Redeclaration of '{var_name}'")
+                if symbol_table[var_name] is not None:
+                    # FUNCTION nodes carry no line number; their last field,
+                    # the body, is reported in its place
+                    line_num = node[-1] if node[0] == "DECLARATION" else self.ast_text(node[3])
+                    self.errors.append(f"Line {line_num}: Redeclaration of '{names[var_name]}'")
                 else:
-                    self.symbol_table[var_name] = {"type": var_type, "value": None}
+                    symbol_table[var_name] = var_type
                 if node[0] == "FUNCTION" and len(node) > 3:
                     self.semantic_analyzer(node[3])
             elif node[0] == "ASSIGNMENT":
                 var_name, value = node[1], node[2]
                 line_num = node[-1]
-                if var_name not in self.symbol_table:
-                    self.errors.append(f"Line {line_num}: Undeclared variable '{var_name}'")
+                if symbol_table[var_name] is None:
+                    self.errors.append(f"Line {line_num}: Undeclared variable '{names[var_name]}'")
                 if isinstance(value, tuple):
                     op, left, right = value
-                    if left not in self.symbol_table and not left.isnumeric():
-                        self.errors.append(f"Line {line_num}: Undeclared variable '{left}'")
-                    if right not in self.symbol_table and not right.isnumeric():
-                        self.errors.append(f"Line {line_num}: Undeclared variable '{right}'")
+                    if symbol_table[left] is None and literal_values[left] is None:
+                        self.errors.append(f"Line {line_num}: Undeclared variable '{names[left]}'")
+                    if symbol_table[right] is None and literal_values[right] is None:
+                        self.errors.append(f"Line {line_num}: Undeclared variable '{names[right]}'")
             elif node[0] == "FOR":
                 init, cond, incr, body = node[1], node[2], node[3], node[4]
                 self.semantic_analyzer([init])
                 for t in cond:
-                    if t[0] == "IDENTIFIER" and t[1] not in self.symbol_table:
-                        self.errors.append(f"Line {t[2]}: Undeclared variable '{t[1]}' in condition")
+                    if t[0] == TOKEN_IDENTIFIER and symbol_table[t[1]] is None:
+                        self.errors.append(f"Line {t[2]}: Undeclared variable '{names[t[1]]}' in condition")
                 for t in incr:
-                    if t[0] == "IDENTIFIER" and t[1] not in self.symbol_table:
-                        self.errors.append(f"Line {t[2]}: Undeclared variable '{t[1]}' in increment")
+                    if t[0] == TOKEN_IDENTIFIER and symbol_table[t[1]] is None:
+                        self.errors.append(f"Line {t[2]}: Undeclared variable '{names[t[1]]}' in increment")
                 self.semantic_analyzer(body)
             elif node[0] == "RETURN":
                 value = node[1]
                 line_num = node[-1]
-                if value not in self.symbol_table and not value.isnumeric():
-                    self.errors.append(f"Line {line_num}: Undeclared variable '{value}' in return")
+                if symbol_table[value] is None and literal_values[value] is None:
+                    self.errors.append(f"Line {line_num}: Undeclared variable '{names[value]}' in return")
 
     def generate_intermediate_code(self):
         self.intermediate_code = []
         def process_nodes(nodes):
             for node in nodes:
-                if node[0] == "DECLARATION" and node[3]:
+                if node[0] == "DECLARATION" and node[3] is not None:
                     if isinstance(node[3], tuple):
                         op, left, right = node[3]
                         self.intermediate_code.append(("binop", node[2], op, left, right, node[4]))
@@ -306,85 +440,323 @@ class CCompiler:
                     self.intermediate_code.append(("return", node[1], node[2]))
                 elif node[0] == "FOR":
                     process_nodes([node[1]])
-                    process_nodes(node[4])
+                    header = self.loop_header(node)
+                    if header is None:
+                        process_nodes(node[4])
+                    else:
+                        # Affine loops keep their structure in the IR so that
+                        # optimize() can fold them
+                        self.intermediate_code.append(header)
+                        process_nodes(node[4])
+                        self.intermediate_code.append(("endloop", header[1], header[-1]))
         process_nodes(self.ast)
         return self.intermediate_code
 
+    def loop_header(self, node):
+        # Recognizes for (i = a; i < b; i = i + c) and for (i = a; i > b; i = i - c)
+        # with literal a, b and c and returns the matching loop op
+        init, cond, incr = node[1], node[2], node[3]
+        if init[0] == "DECLARATION":
+            var, start = init[2], init[3]
+        else:
+            var, start = init[1], init[2]
+        if not isinstance(start, int) or self.literal_values[start] is None:
+            return None
+        if (len(cond) != 3 or cond[0][1] != var or cond[1][1] not in (ID_LESS, ID_GREATER)
+                or cond[2][0] != TOKEN_LITERAL):
+            return None
+        if (len(incr) != 5 or incr[0][1] != var or incr[1][1] != ID_ASSIGN or incr[2][1] != var
+                or incr[3][1] not in (ID_PLUS, ID_MINUS) or incr[4][0] != TOKEN_LITERAL):
+            return None
+        return ("loop", var, start, cond[1][1], cond[2][1], incr[3][1], incr[4][1], init[-1])
+
+    def analyze_loop(self, header):
+        # Returns (var, start, step, trip_count) for a loop op, or None when the
+        # loop does not terminate by stepping towards its bound
+        _, var, start, cmp, bound, step_op, step, _ = header
+        start, bound, step = self.literal_values[start], self.literal_values[bound], self.literal_values[step]
+        if step_op == ID_MINUS:
+            step = -step
+        if cmp == ID_LESS and step > 0:
+            trip_count = max(0, -(-(bound - start) // step))
+        elif cmp == ID_GREATER and step < 0:
+            trip_count = max(0, -(-(start - bound) // -step))
+        else:
+            return None
+        return var, start, step, trip_count
+
+    def fold_loops(self):
+        # Returns the intermediate code with every loop region folded, innermost
+        # first. Regions that cannot be folded keep their body as straight-line
+        # code, and so do the loops around them.
+        self.loop_batch_budget = LOOP_BATCH_BUDGET
+        regions = [[None, [], True]]
+        for op in self.intermediate_code:
+            if op[0] == "loop":
+                regions.append([op, [], True])
+            elif op[0] == "endloop":
+                header, body, exact = regions.pop()
+                folded = self.fold_loop(header, body) if exact else None
+                if folded is None:
+                    regions[-1][1].extend(body)
+                    regions[-1][2] = False
+                else:
+                    regions[-1][1].extend(folded)
+            else:
+                regions[-1][1].append(op)
+        return regions[0][1]
+
+    def fold_loop(self, header, body):
+        # Replaces a loop with the values it leaves behind: variables computed
+        # from the induction variable take their last-iteration value and
+        # accumulators (s = s + x, s = s - x) add the sum of x over all
+        # iterations. Returns None when the body does not fit that shape.
+        loop = self.analyze_loop(header)
+        if loop is None:
+            return None
+        if np is not None:
+            budget = self.loop_batch_budget
+            try:
+                return self.fold_loop_body(header, body, loop, True)
+            except OverflowError:
+                # Both passes charge the same operations, so the retry is
+                # charged as if it were the only one
+                self.loop_batch_budget = budget
+        return self.fold_loop_body(header, body, loop, False)
+
+    def fold_loop_body(self, header, body, loop, use_numpy):
+        # Values are (value, bound) pairs where value is an int, the induction
+        # variable itself or one value per iteration, and bound caps its
+        # magnitude. With use_numpy the per-iteration values are int64 arrays and
+        # OverflowError is raised wherever int64 could overflow; otherwise they
+        # are lists of Python ints.
+        var, start, step, trip_count = loop
+        line_num = header[-1]
+        literal_values = self.literal_values
+        # Stands for the induction variable's own value in series
+        induction = object()
+        last = start + (trip_count - 1) * step
+        induction_bound = max(abs(start), abs(last))
+        series = {}
+        accumulators = {}
+
+        def resolve(operand):
+            value = literal_values[operand]
+            if value is not None:
+                return value, value
+            if operand == var:
+                return induction, induction_bound
+            return series.get(operand)
+
+        def values(value):
+            if value is not induction:
+                return value
+            stop = start + trip_count * step
+            if use_numpy:
+                return np.arange(start, stop, step, dtype=np.int64)
+            return list(range(start, stop, step))
+
+        def apply(op, left, right):
+            (left, left_bound), (right, right_bound) = left, right
+            if op == ID_PLUS or op == ID_MINUS:
+                bound = left_bound + right_bound
+            elif op == ID_TIMES:
+                bound = left_bound * right_bound
+            else:
+                bound = left_bound
+            if isinstance(left, int) and isinstance(right, int):
+                if op == ID_DIVIDE and right == 0:
+                    return None
+                return self.fold_binop(op, left, right), bound
+            if use_numpy and bound >= INT64_SAFE_BOUND:
+                raise OverflowError
+            if trip_count > LOOP_BATCH_LIMIT or trip_count > self.loop_batch_budget:
+                return None
+            self.loop_batch_budget -= trip_count
+            left, right = values(left), values(right)
+            if op == ID_DIVIDE and ((right == 0) if isinstance(right, int) else
+                              (right == 0).any() if use_numpy else 0 in right):
+                return None
+            if use_numpy:
+                return self.fold_binop(op, left, right), bound
+            lefts = repeat(left, trip_count) if isinstance(left, int) else left
+            rights = repeat(right, trip_count) if isinstance(right, int) else right
+            return list(map(BINOP_FUNCTIONS[op], lefts, rights)), bound
+
+        def total(term):
+            value, bound = term
+            if isinstance(value, int):
+                return trip_count * value
+            if value is induction:
+                return trip_count * start + step * trip_count * (trip_count - 1) // 2
+            if use_numpy:
+                if bound * trip_count >= INT64_SAFE_BOUND:
+                    raise OverflowError
+                return int(value.sum())
+            return sum(value)
+
+        for op in body:
+            if op[0] == "assign":
+                target, value = op[1], op[2]
+            elif op[0] == "binop":
+                target, value = op[1], (op[2], op[3], op[4])
+            else:
+                return None
+            if target == var:
+                return None
+            if isinstance(value, tuple):
+                op_type, left, right = value
+                if target not in series and op_type in (ID_PLUS, ID_MINUS) and left == target:
+                    term = resolve(right)
+                    if term is None:
+                        return None
+                    accumulators.setdefault(target, []).append((op_type, term))
+                    continue
+                if target not in series and op_type == ID_PLUS and right == target:
+                    term = resolve(left)
+                    if term is None:
+                        return None
+                    accumulators.setdefault(target, []).append((op_type, term))
+                    continue
+            if target in accumulators:
+                return None
+            if isinstance(value, tuple):
+                left, right = resolve(left), resolve(right)
+                if left is None or right is None:
+                    return None
+                result = apply(op_type, left, right)
+            else:
+                result = resolve(value)
+            if result is None:
+                return None
+            series[target] = result
+
+        folded = []
+        if trip_count == 0:
+            return folded
+        for target, (value, _) in series.items():
+            if value is induction:
+                final = last
+            else:
+                final = value if isinstance(value, int) else int(value[-1])
+            folded.append(self.constant_op(target, final, line_num))
+        for target, terms in accumulators.items():
+            amount = sum(total(term) if op_type == ID_PLUS else -total(term) for op_type, term in terms)
+            if amount >= 0:
+                folded.append(("binop", target, ID_PLUS, target, self.intern(str(amount)), line_num))
+            else:
+                folded.append(("binop", target, ID_MINUS, target, self.intern(str(-amount)), line_num))
+        folded.append(self.constant_op(var, start + trip_count * step, line_num))
+        return folded
+
+    def fold_binop(self, op, left, right):
+        if op == ID_PLUS:
+            return left + right
+        elif op == ID_MINUS:
+            return left - right
+        elif op == ID_TIMES:
+            return left * right
+        return left // right
+
+    def constant_op(self, var, value, line_num):
+        # Literals are unsigned in the IR, so negative constants become 0 - n
+        if value >= 0:
+            return ("assign", var, self.intern(str(value)), line_num)
+        return ("binop", var, ID_MINUS, self.intern("0"), self.intern(str(-value)), line_num)
+
     def optimize(self):
         self.optimized_code = []
-        constants = {}
-        used_vars = set()
-
-        # Collect used variables recursively
-        def collect_used_vars(var):
-            if var in used_vars:
-                return
-            used_vars.add(var)
-            for op in self.intermediate_code:
-                if op[0] == "assign" and op[1] == var and op[2].isalpha():
-                    collect_used_vars(op[2])
-                elif op[0] == "binop" and op[1] == var:
-                    if op[3].isalpha():
-                        collect_used_vars(op[3])
-                    if op[4].isalpha():
-                        collect_used_vars(op[4])
-
-        # Start from return statement
-        for op in self.intermediate_code:
+        code = self.fold_loops()
+        # Folding may intern new literals, so the ID-indexed tables are sized
+        # after it. Literals start out holding their own value.
+        literal_values = self.literal_values
+        constants = list(literal_values)
+        used_vars = bytearray(len(constants))
+
+        # Index definitions by variable once instead of rescanning the whole
+        # intermediate code for every variable reached from the return
+        definitions = {}
+        for op in code:
+            if op[0] == "assign" or op[0] == "binop":
+                definitions.setdefault(op[1], []).append(op)
+
+        # Collect used variables, starting from the return statement. An explicit
+        # stack avoids a self-referencing closure that would keep the index
+        # alive until the next garbage collection.
+        pending = []
+        for op in code:
             if op[0] == "return":
-                collect_used_vars(op[1])
+                pending.append(op[1])
                 break
+        while pending:
+            var = pending.pop()
+            if used_vars[var]:
+                continue
+            used_vars[var] = 1
+            for op in definitions.get(var, ()):
+                if op[0] == "assign" and literal_values[op[2]] is None:
+                    pending.append(op[2])
+                elif op[0] == "binop":
+                    if literal_values[op[3]] is None:
+                        pending.append(op[3])
+                    if literal_values[op[4]] is None:
+                        pending.append(op[4])
 
         # Constant folding and propagation
-        for op in self.intermediate_code:
+        for op in code:
             if op[0] == "assign":
-                var, value, _ = op[1], op[2], op[3]
-                if value.isnumeric():
-                    constants[var] = int(value)
-                elif value in constants:
-                    constants[var] = constants[value]
+                value = constants[op[2]]
+                if value is not None:
+                    constants[op[1]] = value
             elif op[0] == "binop":
                 var, op_type, left, right, line_num = op[1], op[2], op[3], op[4], op[5]
-                left_val = int(left) if left.isnumeric() else constants.get(left)
-                right_val = int(right) if right.isnumeric() else constants.get(right)
+                left_val = constants[left]
+                right_val = constants[right]
                 if left_val is not None and right_val is not None:
-                    if op_type == "+":
+                    if op_type == ID_PLUS:
                         constants[var] = left_val + right_val
-                    elif op_type == "-":
+                    elif op_type == ID_MINUS:
                         constants[var] = left_val - right_val
-                    elif op_type == "*":
+                    elif op_type == ID_TIMES:
                         constants[var] = left_val * right_val
-                    elif op_type == "/":
+                    elif op_type == ID_DIVIDE:
                         if right_val != 0:
                             constants[var] = left_val // right_val
                         else:
                             self.errors.append(f"Line {line_num}: Division by zero")
 
         # Generate optimized code
-        for op in self.intermediate_code:
+        for op in code:
             if op[0] == "return":
                 value, line_num = op[1], op[2]
-                final_value = str(constants.get(value, value))
-                self.optimized_code.append(("return", final_value, line_num))
+                if literal_values[value] is None and constants[value] is not None:
+                    value = self.intern(str(constants[value]))
+                self.optimized_code.append(("return", value, line_num))
                 break
 
         return self.optimized_code
 
     def generate_assembly(self):
+        names = self.string_table
+        literal_values = self.literal_values
+
+        def operand(sid):
+            return names[sid] if literal_values[sid] is not None else f"[{names[sid]}]"
+
         self.assembly_code = ["section .text", "global _start", "_start:"]
         for op in self.optimized_code:
             if op[0] == "assign":
-                self.assembly_code.append(f"mov eax, {op[2]}")
-                self.assembly_code.append(f"mov [{op[1]}], eax")
+                self.assembly_code.append(f"mov eax, {names[op[2]]}")
+                self.assembly_code.append(f"mov [{names[op[1]]}], eax")
             elif op[0] == "binop":
-                self.assembly_code.append(f"mov eax, {'[' + op[3] + ']' if not isinstance(op[3], int) and not op[3].isnumeric() else op[3]}")
-                if op[2] == "+":
-                    self.assembly_code.append(f"add eax, {'[' + op[4] + ']' if not isinstance(op[4], int) and not op[4].isnumeric() else op[4]}")
-                elif op[2] == "*":
-                    self.assembly_code.append(f"imul eax, {'[' + op[4] + ']' if not isinstance(op[4], int) and not op[4].isnumeric() else op[4]}")
-                self.assembly_code.append(f"mov [{op[1]}], eax")
+                self.assembly_code.append(f"mov eax, {operand(op[3])}")
+                if op[2] == ID_PLUS:
+                    self.assembly_code.append(f"add eax, {operand(op[4])}")
+                elif op[2] == ID_TIMES:
+                    self.assembly_code.append(f"imul eax, {operand(op[4])}")
+                self.assembly_code.append(f"mov [{names[op[1]]}], eax")
             elif op[0] == "return":
-                self.assembly_code.append(f"mov eax, {op[1]}")
+                self.assembly_code.append(f"mov eax, {names[op[1]]}")
         self.assembly_code.append("int 0x80")
         return self.assembly_code
 
@@ -394,9 +766,175 @@ class CCompiler:
     def link(self):
         return "Linked executable generated (simulated)"
 
+    def dump(self):
+        out = bytearray(ARTIFACT_HEADER.pack(ARTIFACT_MAGIC, ARTIFACT_VERSION))
+        pack_strings(out, self.string_table)
+        pack_tokens(out, self.tokens, len(self.string_table))
+        tables = ([], [], [[] for _ in NODE_WIDTHS], [], [])
+        pack_node_list(self.ast, tables)
+        kinds, lengths, rows, token_ends, loop_tokens = tables
+        pack_column(out, kinds)
+        pack_column(out, lengths)
+        for width, kind_rows in zip(NODE_WIDTHS, rows):
+            for column in (list(zip(*kind_rows)) or [()] * width):
+                pack_column(out, column)
+        pack_column(out, token_ends)
+        pack_tokens(out, loop_tokens, len(self.string_table))
+        pack_code(out, self.intermediate_code)
+        pack_code(out, self.optimized_code)
+        pack_strings(out, self.assembly_code)
+        pack_strings(out, self.errors)
+        return bytes(out)
+
+    def load(self, data):
+        view = memoryview(data).cast("B")
+        if len(view) < ARTIFACT_HEADER.size:
+            raise ValueError("Truncated compiler artifact")
+        magic, version = ARTIFACT_HEADER.unpack_from(view, 0)
+        if magic != ARTIFACT_MAGIC:
+            raise ValueError("Not a compiler artifact")
+        if version != ARTIFACT_VERSION:
+            raise ValueError(f"Unsupported compiler artifact version {version}")
+        offset = ARTIFACT_HEADER.size
+
+        def read_column():
+            # On little-endian hosts columns are cast in place and converted to
+            # a list in one call rather than copied
+            nonlocal offset
+            size, count = ARTIFACT_COLUMN.unpack_from(view, offset)
+            offset += ARTIFACT_COLUMN.size
+            end = offset + size * count
+            if end > len(view):
+                raise ValueError("Truncated compiler artifact")
+            if sys.byteorder == "little":
+                column = view[offset:end].cast(COLUMN_TYPECODES[size])
+            else:
+                column = array(COLUMN_TYPECODES[size], view[offset:end])
+                column.byteswap()
+            offset = end
+            return column.tolist()
+
+        def read_columns(width, id_fields, table_size):
+            columns = [read_column() for _ in range(width)]
+            for column in columns[:id_fields]:
+                if len(column) != len(columns[0]) or (column and max(column) >= table_size):
+                    raise ValueError("String ID out of range in compiler artifact")
+            if any(len(column) != len(columns[0]) for column in columns):
+                raise ValueError("Corrupt columns in compiler artifact")
+            return columns
+
+        def read_strings():
+            nonlocal offset
+            ends = read_column()
+            size = ends[-1] if ends else 0
+            if offset + size > len(view):
+                raise ValueError("Truncated compiler artifact")
+            blob = bytes(view[offset:offset + size])
+            offset += size
+            starts = [0, *ends[:-1]]
+            if blob.isascii():
+                text = blob.decode("ascii")
+                return [text[start:end] for start, end in zip(starts, ends)]
+            return [blob[start:end].decode("utf-8") for start, end in zip(starts, ends)]
+
+        def read_tokens(table_size):
+            types, ids, lines = read_columns(3, 2, table_size)
+            if types and max(types) >= len(TOKEN_TYPES):
+                raise ValueError("Invalid token type in compiler artifact")
+            return list(zip(types, ids, lines))
+
+        def interleave(kinds, items):
+            # Takes the next item of each kind in kind order; every item must
+            # be used exactly once
+            result = list(map(next, map(items.__getitem__, kinds)))
+            if len(result) != len(kinds) or any(next(kind_items, None) is not None for kind_items in items):
+                raise ValueError("Corrupt columns in compiler artifact")
+            return result
+
+        def read_code(table_size):
+            kinds = read_column()
+            ops = [zip(repeat(name), *read_columns(arity + 1, arity, table_size))
+                   for name, arity in zip(IR_OPS, IR_ARITY)]
+            return interleave(kinds, ops)
+
+        def read_ast(table_size):
+            kinds = read_column()
+            lengths = read_column()
+            (declarations, valued, expressions, assignments, assigned,
+             returns, functions, loops) = [read_columns(width, id_fields, table_size)
+                                           for width, id_fields in zip(NODE_WIDTHS, NODE_ID_FIELDS)]
+            token_ends = read_column()
+            loop_tokens = read_tokens(table_size)
+            if token_ends and token_ends[-1] != len(loop_tokens):
+                raise ValueError("Corrupt loop tokens in compiler artifact")
+            spans = list(map(slice, [0, *token_ends[:-1]], token_ends))
+            # Lists are built children first, so FUNCTION and FOR fields only
+            # refer to lists already in node_lists
+            node_lists = []
+            type_ids, names, values, lines = declarations[0], declarations[1], repeat(None), declarations[2]
+            nodes = [
+                zip(repeat("DECLARATION"), type_ids, names, values, lines),
+                zip(repeat("DECLARATION"), *valued),
+                zip(repeat("DECLARATION"), expressions[0], expressions[1],
+                    zip(expressions[2], expressions[3], expressions[4]), expressions[5]),
+                zip(repeat("ASSIGNMENT"), *assignments),
+                zip(repeat("ASSIGNMENT"), assigned[0], zip(assigned[1], assigned[2], assigned[3]), assigned[4]),
+                zip(repeat("RETURN"), *returns),
+                zip(repeat("FUNCTION"), functions[0], functions[1], map(node_lists.__getitem__, functions[2])),
+                zip(repeat("FOR"), map(itemgetter(0), map(node_lists.__getitem__, loops[0])),
+                    map(loop_tokens.__getitem__, spans[0::2]), map(loop_tokens.__getitem__, spans[1::2]),
+                    map(node_lists.__getitem__, loops[1])),
+            ]
+            stream = map(next, map(nodes.__getitem__, kinds))
+            for length in lengths:
+                node_lists.append(list(islice(stream, length)))
+            if (not node_lists or list(map(len, node_lists)) != lengths
+                    or next(stream, None) is not None
+                    or any(next(kind_nodes, None) is not None for kind_nodes in nodes)):
+                raise ValueError("Corrupt AST columns in compiler artifact")
+            return node_lists[-1]
+
+        # Decode everything before touching the compiler state, so a bad
+        # artifact leaves the previous results in place
+        try:
+            strings = read_strings()
+            table_size = len(strings)
+            tokens = read_tokens(table_size)
+            ast = read_ast(table_size)
+            intermediate_code = read_code(table_size)
+            optimized_code = read_code(table_size)
+            assembly_code = read_strings()
+            errors = read_strings()
+        except (struct.error, IndexError, KeyError, TypeError):
+            raise ValueError("Truncated or corrupt compiler artifact") from None
+        string_ids = dict(zip(strings, range(table_size)))
+        if len(string_ids) != table_size or tuple(strings[:len(KEYWORDS + OPERATORS)]) != KEYWORDS + OPERATORS:
+            raise ValueError("Corrupt string table in compiler artifact")
+
+        self.reset_state()
+        self.string_table = strings
+        self.string_ids = string_ids
+        self.literal_values = [int(text) if text.isdecimal() else None for text in strings]
+        self.tokens = tokens
+        self.ast = ast
+        self.intermediate_code = intermediate_code
+        self.optimized_code = optimized_code
+        self.assembly_code = assembly_code
+        self.errors = errors
+        return self
+
     def compile(self, code):
         self.reset_state()
-        self.lexer(code)
+        # Every top-level chunk but the last ends with '}', so counting them
+        # rules out most sources before splitting
+        if code.count("}") >= PARALLEL_MIN_FUNCTIONS and parallel_lexer_enabled():
+            chunks = split_top_level(code)
+        else:
+            chunks = []
+        if len(chunks) < PARALLEL_MIN_FUNCTIONS:
+            self.lexer(code)
+        else:
+            self.lexer_calibrated(code, chunks)
         if self.errors:
             return self.errors
         self.parser()
@@ -412,24 +950,494 @@ class CCompiler:
         self.link()
         return []
 
+    def lexer_calibrated(self, code, chunks):
+        # Large sources are lexed by the lexer next_lexer() picks, and every
+        # run is timed to update that lexer's average rate
+        if next_lexer() == "serial":
+            started = time.perf_counter()
+            self.lexer(code)
+            record_lexer_rate("serial", len(code) / (time.perf_counter() - started))
+            return self.tokens
+        pool = get_compile_pool()
+        started = time.perf_counter()
+        batch_count = (os.cpu_count() or 1) * 2
+        batches = [chunks[len(chunks) * k // batch_count:len(chunks) * (k + 1) // batch_count]
+                   for k in range(batch_count)]
+        results = list(pool.map(lex_chunks, batches))
+        if any(errors for errors, _, _, _, _ in results):
+            # Diagnostics always come from the serial lexer so they read the
+            # same as on a serial compile
+            return self.lexer(code)
+        self.code = code
+        for _, token_types, string_ids, lines, strings in results:
+            canonical = [self.intern(text) for text in strings]
+            self.tokens.extend(zip(token_types, map(canonical.__getitem__, array('I', string_ids)),
+                                   array('I', lines)))
+        record_lexer_rate("parallel", len(code) / (time.perf_counter() - started))
+        return self.tokens
+
+    # Display helpers: the same structures with string IDs replaced by their text
+
+    def token_text(self, tokens):
+        names = self.string_table
+        return [(TOKEN_TYPES[token_type], names[sid], line_num) for token_type, sid, line_num in tokens]
+
+    def ast_text(self, nodes):
+        return [self.node_text(node) for node in nodes]
+
+    def node_text(self, node):
+        names = self.string_table
+        if node[0] == "FUNCTION":
+            return (node[0], names[node[1]], names[node[2]], self.ast_text(node[3]))
+        if node[0] == "FOR":
+            return (node[0], self.node_text(node[1]), self.token_text(node[2]),
+                    self.token_text(node[3]), self.ast_text(node[4]))
+        # DECLARATION, ASSIGNMENT and RETURN: string IDs, None or an
+        # (op, left, right) triple of IDs, then the line number
+        fields = [node[0]]
+        for value in node[1:-1]:
+            if isinstance(value, tuple):
+                fields.append(tuple(names[sid] for sid in value))
+            else:
+                fields.append(None if value is None else names[value])
+        fields.append(node[-1])
+        return tuple(fields)
+
+    def ir_text(self, code):
+        # Every IR op is (name, string IDs..., line number)
+        names = self.string_table
+        return [(op[0], *[names[sid] for sid in op[1:-1]], op[-1]) for op in code]
+
+    def phases(self):
+        # Per-phase results for clients that render each phase themselves
+        return {
+            "errors": self.errors,
+            "tokens": self.token_text(self.tokens),
+            "ast": self.ast_text(self.ast),
+            "intermediate": self.ir_text(self.intermediate_code),
+            "optimized": self.ir_text(self.optimized_code),
+            "assembly": self.assembly_code,
+        }
+
     def run(self):
         if self.errors:
             return "\n".join(self.errors)
         return "\n".join([
-            "Tokens:", str(self.tokens), "",
-            "AST:", str(self.ast), "",
-            "Intermediate Code:", "\n".join(str(op) for op in self.intermediate_code), "",
-            "Optimized Code:", "\n".join(str(op) for op in self.optimized_code), "",
+            "Tokens:", str(self.token_text(self.tokens)), "",
+            "AST:", str(self.ast_text(self.ast)), "",
+            "Intermediate Code:", "\n".join(str(op) for op in self.ir_text(self.intermediate_code)), "",
+            "Optimized Code:", "\n".join(str(op) for op in self.ir_text(self.optimized_code)), "",
             "Assembly Code:", "\n".join(self.assembly_code)
         ])
 
+def split_top_level(code):
+    # Cuts the source after every '}' that closes a top-level block, keeping the
+    # line each chunk starts on so token line numbers match the whole file
+    chunks = []
+    depth = 0
+    start = 0
+    start_line = line_num = 1
+    for match in BRACE_SCAN_PATTERN.finditer(code):
+        text = match.group()
+        if text == "\n":
+            line_num += 1
+        elif text == "{":
+            depth += 1
+        elif text == "}" and depth > 0:
+            depth -= 1
+            if depth == 0:
+                chunks.append((start_line, code[start:match.end()]))
+                start = match.end()
+                start_line = line_num
+    if code[start:].strip():
+        chunks.append((start_line, code[start:]))
+    return chunks
+
+def pack_column(out, values, top=None):
+    # top is an upper bound on the values when the caller knows one
+    if top is None:
+        top = max(values, default=0)
+    size = 1 if top < 1 << 8 else 2 if top < 1 << 16 else 4
+    column = array(COLUMN_TYPECODES[size], values)
+    if sys.byteorder != "little":
+        column.byteswap()
+    out += ARTIFACT_COLUMN.pack(size, len(column))
+    out += column.tobytes()
+
+def pack_strings(out, strings):
+    text = "".join(strings)
+    if text.isascii():
+        pack_column(out, list(accumulate(map(len, strings))))
+        out += text.encode("ascii")
+    else:
+        encoded = [string.encode("utf-8") for string in strings]
+        pack_column(out, list(accumulate(map(len, encoded))))
+        out += b"".join(encoded)
+
+def pack_tokens(out, tokens, table_size):
+    pack_column(out, [token[0] for token in tokens], len(TOKEN_TYPES))
+    pack_column(out, [token[1] for token in tokens], table_size)
+    pack_column(out, [token[2] for token in tokens])
+
+def pack_code(out, code):
+    kinds = [IR_KINDS[op[0]] for op in code]
+    groups = [[] for _ in IR_OPS]
+    for kind, op in zip(kinds, code):
+        groups[kind].append(op)
+    pack_column(out, kinds)
+    for arity, ops in zip(IR_ARITY, groups):
+        for column in (list(zip(*ops))[1:] or [()] * (arity + 1)):
+            pack_column(out, column)
+
+def pack_node_list(nodes, tables):
+    # Adds nodes as one node list to the (kinds, list lengths, rows per node
+    # kind, FOR token end offsets, FOR tokens) tables, after the lists nested
+    # in them, and returns its index
+    kinds, lengths, rows, token_ends, loop_tokens = tables
+    nested = []
+    for node in nodes:
+        if node[0] == "FUNCTION":
+            nested.append(pack_node_list(node[3], tables))
+        elif node[0] == "FOR":
+            nested.append((pack_node_list((node[1],), tables), pack_node_list(node[4], tables)))
+    nested = iter(nested)
+    for node in nodes:
+        if node[0] == "FUNCTION":
+            kind, row = NODE_FUNCTION, (node[1], node[2], next(nested))
+        elif node[0] == "FOR":
+            kind, row = NODE_FOR, next(nested)
+            loop_tokens += node[2]
+            token_ends.append(len(loop_tokens))
+            loop_tokens += node[3]
+            token_ends.append(len(loop_tokens))
+        elif node[0] == "RETURN":
+            kind, row = NODE_RETURN, node[1:]
+        elif node[0] == "DECLARATION":
+            value = node[3]
+            if value is None:
+                kind, row = NODE_DECLARATION, (node[1], node[2], node[4])
+            elif isinstance(value, tuple):
+                kind, row = NODE_DECLARATION_EXPR, (node[1], node[2], *value, node[4])
+            else:
+                kind, row = NODE_DECLARATION_VALUE, node[1:]
+        elif isinstance(node[2], tuple):
+            kind, row = NODE_ASSIGNMENT_EXPR, (node[1], *node[2], node[3])
+        else:
+            kind, row = NODE_ASSIGNMENT, node[1:]
+        kinds.append(kind)
+        rows[kind].append(row)
+    lengths.append(len(nodes))
+    return len(lengths) - 1
+
+def lex_chunks(chunks):
+    # Runs in a pool worker. Tokens are sent back as columns (types, IDs in
+    # this batch's string table, line numbers) so the parent rebuilds them
+    # without unpickling a tuple per token
+    chunk_compiler = CCompiler()
+    errors = []
+    token_types = bytearray()
+    string_ids = array('I')
+    lines = array('I')
+    for first_line, code in chunks:
+        chunk_compiler.lexer(code, first_line)
+        errors.extend(chunk_compiler.errors)
+        for token_type, sid, line_num in chunk_compiler.tokens:
+            token_types.append(token_type)
+            string_ids.append(sid)
+            lines.append(line_num)
+    return errors, bytes(token_types), string_ids.tobytes(), lines.tobytes(), chunk_compiler.string_table
+
+compile_pool = None
+# Pre-forked workers already compile in parallel with each other and leave this
+# off rather than each starting a pool of their own
+parallel_compile = True
+# Moving average of the characters per second and number of samples for the
+# serial and pooled lexer, measured on sources large enough to use the pool
+lexer_rates = {}
+# Sources that passed the quick size check, counted to space out resampling
+lexer_candidates = 0
+
+def get_compile_pool():
+    global compile_pool
+    if compile_pool is None:
+        workers = os.cpu_count() or 1
+        compile_pool = ProcessPoolExecutor(workers)
+        # Workers start on the first submit; start them here rather than in
+        # the first timed lex
+        list(compile_pool.map(lex_chunks, [[]] * workers))
+    return compile_pool
+
+def record_lexer_rate(lexer, rate):
+    average, samples = lexer_rates.get(lexer, (0.0, 0))
+    samples += 1
+    # A plain mean until the weight of a new sample drops to LEXER_RATE_WEIGHT
+    average += (rate - average) * max(1 / samples, LEXER_RATE_WEIGHT)
+    lexer_rates[lexer] = (average, samples)
+
+def preferred_lexer():
+    # The lexer with the higher average rate, or None while calibrating
+    serial_rate, serial_samples = lexer_rates.get("serial", (0.0, 0))
+    parallel_rate, parallel_samples = lexer_rates.get("parallel", (0.0, 0))
+    if min(serial_samples, parallel_samples) < LEXER_CALIBRATION_SAMPLES:
+        return None
+    return "parallel" if parallel_rate > serial_rate else "serial"
+
+def next_lexer():
+    preferred = preferred_lexer()
+    if preferred is None:
+        # Alternate, so both are timed on similar sources
+        serial_samples = lexer_rates.get("serial", (0.0, 0))[1]
+        return "serial" if serial_samples <= lexer_rates.get("parallel", (0.0, 0))[1] else "parallel"
+    if lexer_candidates % LEXER_RESAMPLE_INTERVAL == 0:
+        return "serial" if preferred == "parallel" else "parallel"
+    return preferred
+
+def parallel_lexer_enabled():
+    global lexer_candidates
+    if not parallel_compile or (os.cpu_count() or 1) < 2:
+        return False
+    lexer_candidates += 1
+    # While the serial lexer is faster, sources are only split when the pool
+    # is due to be timed again
+    return preferred_lexer() != "serial" or next_lexer() == "parallel"
+
+class SharedResultCache:
+    """Fixed-size cache of serialized compile results shared by forked workers.
+
+    The shared block holds a header, an open-addressed table of slots keyed by
+    a SHA-256 digest, and a ring buffer holding the sources and response
+    bodies. Positions in the ring are absolute byte counts that only grow:
+    the header keeps the position of the next write and each slot keeps the
+    position of its data, so a slot whose bytes have since been overwritten is
+    recognised as stale and treated as a miss. Writers serialize on a lock;
+    readers take no lock and instead check each slot's sequence number, which
+    is odd while the slot is being written, and re-check after copying that
+    the ring has not wrapped over the data they read. Shared fields are
+    always written by copying packed bytes in, because struct.pack_into
+    zero-fills its target first and a concurrent reader could see the zeros.
+    """
+
+    HEADER = struct.Struct("<IIQ")
+    HEAD = struct.Struct("<Q")
+    HEAD_OFFSET = 8
+    SLOT = struct.Struct("<I32sQI")
+    SEQ = struct.Struct("<I")
+    PROBES = 8
+
+    def __init__(self, slots=4096, data_size=64 * 1024 * 1024):
+        self.slots = slots
+        self.data_size = data_size
+        self.data_start = self.HEADER.size + slots * self.SLOT.size
+        self.shm = shared_memory.SharedMemory(create=True, size=self.data_start + data_size)
+        self.buf = self.shm.buf
+        self.buf[:self.data_start] = bytes(self.data_start)
+        self.HEADER.pack_into(self.buf, 0, slots, 0, 0)
+        self.lock = multiprocessing.Lock()
+
+    def _slot_offsets(self, key):
+        start = int.from_bytes(key[:4], "little") % self.slots
+        for probe in range(self.PROBES):
+            yield self.HEADER.size + ((start + probe) % self.slots) * self.SLOT.size
+
+    def _head(self):
+        return self.HEAD.unpack_from(self.buf, self.HEAD_OFFSET)[0]
+
+    def _intact(self, position):
+        # Data written at position survives until the ring has moved a full
+        # lap past it
+        return self._head() <= position + self.data_size
+
+    def get(self, key):
+        for slot in self._slot_offsets(key):
+            seq, slot_key, position, length = self.SLOT.unpack_from(self.buf, slot)
+            if seq == 0:
+                return None
+            if seq % 2 or slot_key != key:
+                continue
+            if not self._intact(position):
+                return None
+            start = self.data_start + position % self.data_size
+            data = bytes(self.buf[start:start + length])
+            if self.SLOT.unpack_from(self.buf, slot)[0] != seq or not self._intact(position):
+                return None
+            return data
+        return None
+
+    def put(self, key, data):
+        if len(data) > self.data_size:
+            return False
+        with self.lock:
+            position = self._head()
+            # Entries never straddle the end of the ring; skip to the next lap
+            if position % self.data_size + len(data) > self.data_size:
+                position += self.data_size - position % self.data_size
+            # Move the head before overwriting, so readers of the old bytes
+            # see that they are gone
+            self.buf[self.HEAD_OFFSET:self.HEAD_OFFSET + self.HEAD.size] = self.HEAD.pack(position + len(data))
+            start = self.data_start + position % self.data_size
+            self.buf[start:start + len(data)] = data
+            target = None
+            for slot in self._slot_offsets(key):
+                seq, slot_key, slot_position, _ = self.SLOT.unpack_from(self.buf, slot)
+                if seq == 0 or slot_key == key or not self._intact(slot_position):
+                    target = slot
+                    break
+            if target is None:
+                target = next(self._slot_offsets(key))
+            seq = self.SLOT.unpack_from(self.buf, target)[0]
+            self.buf[target:target + self.SEQ.size] = self.SEQ.pack(seq + 1)
+            self.buf[target:target + self.SLOT.size] = self.SLOT.pack(seq + 1, key, position, len(data))
+            self.buf[target:target + self.SEQ.size] = self.SEQ.pack(seq + 2)
+            return True
+
+    def close(self, unlink=False):
+        self.buf = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
 compiler = CCompiler()
+result_cache = None
+# Sources seen by /run, keyed by SHA-256 hex digest, so /compile/<sha256> can
+# serve them with a cacheable GET
+recent_sources = OrderedDict()
+RECENT_SOURCES_LIMIT = 1024
+COMPRESS_MIN_SIZE = 1024
+RESULT_MIMETYPES = {'bin': 'application/octet-stream', 'phases': 'application/json', 'json': 'application/json'}
+
+WARMUP_SOURCE = """int main() {
+    int x = 5;
+    int y = x + 3;
+    for (int i = 0; i < 10; i = i + 1) {
+        y = y + i;
+    }
+    return y;
+}"""
+
+def remember_source(code):
+    # Keeps the source for /compile/<sha256>. Pre-forked workers also share it
+    # under its digest, so any worker can compile what another one was sent
+    key = hashlib.sha256(code.encode('utf-8')).digest()
+    digest = key.hex()
+    recent_sources[digest] = code
+    recent_sources.move_to_end(digest)
+    if len(recent_sources) > RECENT_SOURCES_LIMIT:
+        recent_sources.popitem(last=False)
+    if result_cache is not None and result_cache.get(key) is None:
+        result_cache.put(key, code.encode('utf-8'))
+    return digest
+
+def shared_source(digest):
+    if result_cache is None:
+        return None
+    data = result_cache.get(bytes.fromhex(digest))
+    return None if data is None else data.decode('utf-8')
+
+def serve_prefork(host, port, workers):
+    global result_cache, parallel_compile
+    parallel_compile = False
+    # Everything built here is inherited by the workers through fork
+    compiler.compile(WARMUP_SOURCE)
+    compiler.run()
+    result_cache = SharedResultCache()
+    server = make_server(host, port, app)
+    children = {}
+    stop_signals = {signal.SIGINT, signal.SIGTERM}
+
+    def spawn():
+        # Hold stop signals across fork so neither side handles one while the
+        # child still runs the parent's handler
+        signal.pthread_sigmask(signal.SIG_BLOCK, stop_signals)
+        pid = os.fork()
+        if pid == 0:
+            # Workers leave Ctrl+C to the parent and stop on its SIGTERM
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, stop_signals)
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        children[pid] = time.monotonic()
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, stop_signals)
+
+    def stop(signum, frame):
+        raise SystemExit(0)
+
+    previous = {signum: signal.signal(signum, stop) for signum in stop_signals}
+    try:
+        for _ in range(workers):
+            spawn()
+        logger.info(f"Started {workers} workers on {host}:{port}")
+        while True:
+            pid, status = os.wait()
+            started = children.pop(pid, None)
+            if started is None:
+                continue
+            logger.warning(f"Worker {pid} exited with status {status}, restarting it")
+            # Back off when workers die right after starting
+            if time.monotonic() - started < 1:
+                time.sleep(1)
+            spawn()
+    finally:
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        server.server_close()
+        result_cache.close(unlink=True)
+        logger.info("Stopped workers")
 
 @app.route('/')
 def serve_index():
     logger.info("Serving index.html from templates")
     return render_template('index.html')
 
+def wants_binary():
+    return request.accept_mimetypes.best_match(['application/json', 'application/octet-stream']) == 'application/octet-stream'
+
+def representation(view):
+    if wants_binary():
+        return 'bin'
+    return 'phases' if view == 'phases' else 'json'
+
+def result_etag(digest, kind):
+    # A result only depends on the source, the compiler and artifact versions
+    # and the representation
+    return f"{digest}-v{COMPILER_VERSION}.{ARTIFACT_VERSION}-{kind}"
+
+def render_result(kind):
+    if kind == 'bin':
+        return Response(compiler.dump(), mimetype='application/octet-stream')
+    if kind == 'phases':
+        return jsonify({'phases': compiler.phases()})
+    output = compiler.run()
+    return jsonify({'output': output})
+
+def compiled_response(digest, code, kind):
+    # Pre-forked workers share the finished response body of every
+    # representation, so a hit is a copy out of shared memory instead of a
+    # compile or an artifact load
+    if result_cache is None:
+        compiler.compile(code)
+        return render_result(kind)
+    key = hashlib.sha256(result_etag(digest, kind).encode('ascii')).digest()
+    data = result_cache.get(key)
+    if data is not None:
+        return Response(data, mimetype=RESULT_MIMETYPES[kind])
+    compiler.compile(code)
+    response = render_result(kind)
+    result_cache.put(key, response.get_data())
+    return response
+
 @app.route('/run', methods=['POST'])
 def run_code():
     try:
@@ -438,13 +1446,88 @@ def run_code():
             return jsonify({'output': 'No code provided'}), 400
         code = data.get('code', '')
         logger.info("Running compiled code")
-        compiler.compile(code)
-        output = compiler.run()
-        return jsonify({'output': output})
+        digest = remember_source(code)
+        kind = representation(data.get('view'))
+        response = compiled_response(digest, code, kind)
+        # Point at the GET that returns this same representation; the binary
+        # artifact has no URL of its own, only Accept negotiation
+        location = f"/compile/{digest}"
+        if kind == 'phases':
+            response.headers['Content-Location'] = f"{location}?view=phases"
+        elif kind == 'json':
+            response.headers['Content-Location'] = location
+        return response
     except Exception as e:
         logger.error(f"Error in /run: {str(e)}")
         return jsonify({'output': f"Error: {str(e)}"}), 500
 
+@app.route('/compile/<digest>', methods=['GET'])
+def compile_by_hash(digest):
+    try:
+        digest = digest.lower()
+        if len(digest) != 64 or any(c not in '0123456789abcdef' for c in digest):
+            return jsonify({'output': 'Invalid SHA-256 digest'}), 400
+        code = recent_sources.get(digest)
+        if code is not None:
+            recent_sources.move_to_end(digest)
+        else:
+            code = shared_source(digest)
+        if code is None:
+            return jsonify({'output': 'Unknown source; POST it to /run first'}), 404
+        # The ETag is known without compiling, so it is checked first
+        kind = representation(request.args.get('view'))
+        etag = result_etag(digest, kind)
+        # compress_response tags a compressed body with its encoding, so only
+        # the encoding this request would get can match
+        encoding = negotiated_encoding()
+        tags = (etag, f"{etag}-{encoding}") if encoding else (etag,)
+        for tag in tags:
+            if request.if_none_match.contains(tag):
+                response = Response(status=304)
+                response.set_etag(tag)
+                response.vary.update(('Accept', 'Accept-Encoding'))
+                return response
+        logger.info(f"Serving compiled code for {digest}")
+        response = compiled_response(digest, code, kind)
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = 86400
+        response.vary.add('Accept')
+        return response
+    except Exception as e:
+        logger.error(f"Error in /compile: {str(e)}")
+        return jsonify({'output': f"Error: {str(e)}"}), 500
+
+def negotiated_encoding():
+    return request.accept_encodings.best_match(['br', 'gzip'] if brotli else ['gzip'])
+
+@app.after_request
+def compress_response(response):
+    if (response.status_code != 200 or response.direct_passthrough
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    encoding = negotiated_encoding()
+    if encoding == 'br':
+        response.set_data(brotli.compress(data, quality=5))
+    elif encoding == 'gzip':
+        response.set_data(gzip.compress(data, compresslevel=6))
+    else:
+        return response
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f"{etag}-{encoding}")
+    return response
+
 if __name__ == '__main__':
-    logger.info("Starting Flask server on 0.0.0.0:5000")
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    workers = int(os.environ.get('COMPILER_WORKERS', '1'))
+    if workers > 1:
+        logger.info(f"Starting {workers} pre-forked workers on 0.0.0.0:5000")
+        serve_prefork('0.0.0.0', 5000, workers)
+    else:
+        logger.info("Starting Flask server on 0.0.0.0:5000")
+        app.run(debug=True, host='0.0.0.0', port=5000)